@@ -0,0 +1,376 @@
+# SPDX-FileCopyrightText: 2023 Efabless Corporation
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#      http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# SPDX-License-Identifier: Apache-2.0
+"""Mixed RTL/gate-level simulation for caravel_cocotb.
+
+synth    synthesizes blocks with yosys into verilog/gl_mixed/<block>.v.
+includes derives an include list from includes.rtl.caravel_user_project in
+         which the selected blocks use their netlist instead of their RTL.
+run      runs a test with that include list in place of the RTL one.
+restore  puts back the RTL include list after an interrupted run.
+
+includes and run resynthesize a netlist when it is older than its sources
+or was synthesized with other parameters.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import click
+import yaml
+
+UTIL = '$(USER_PROJECT_VERILOG)/../ip/CF_IP_UTIL/hdl/rtl'
+
+# Blocks that can be swapped for their netlist, keyed by module name.
+#   rtl:    sources replaced by the netlist; must match the paths used in
+#           includes.rtl.caravel_user_project.
+#   deps:   extra sources read for synthesis only (they stay in the RTL list).
+#   macros: hard macros, read as blackboxes for synthesis.
+#   params: the block is synthesized with the parameter overrides of its
+#           instance in user_project.v. The netlist has no parameters, so
+#           user_project.v drops its #(...) when GL_<BLOCK> is defined.
+GL_BLOCKS = {
+    'wishbone_bus_splitter': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/rtl/wishbone_bus_splitter.v'],
+        'params': True,
+    },
+    'WB_PIC': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/rtl/WB_PIC.v'],
+    },
+    'adc_wb_wrapper': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/rtl/adc_wb_wrapper.v'],
+        'deps': ['$(USER_PROJECT_VERILOG)/../ip/sky130_ef_ip__adc3v_12bit/verilog/sar_ctrl.v'],
+        'macros': ['$(USER_PROJECT_VERILOG)/rtl/stubs/ADC_TOP.v'],
+    },
+    'CF_TMR32_WB': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/../ip/CF_TMR32/hdl/rtl/CF_TMR32.v',
+                '$(USER_PROJECT_VERILOG)/../ip/CF_TMR32/hdl/rtl/bus_wrappers/CF_TMR32_WB.v'],
+        'deps': [f'{UTIL}/cf_fifo.v', f'{UTIL}/cf_glitch_filter.v'],
+    },
+    'CF_UART_WB': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/../ip/CF_UART/hdl/rtl/CF_UART.v',
+                '$(USER_PROJECT_VERILOG)/../ip/CF_UART/hdl/rtl/bus_wrappers/CF_UART_WB.v'],
+        'deps': [f'{UTIL}/cf_fifo.v', f'{UTIL}/cf_glitch_filter.v'],
+    },
+    'CF_SPI_WB': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/../ip/CF_SPI/hdl/rtl/CF_SPI.v',
+                '$(USER_PROJECT_VERILOG)/../ip/CF_SPI/hdl/rtl/bus_wrappers/CF_SPI_WB.v'],
+        'deps': [f'{UTIL}/cf_fifo.v', f'{UTIL}/cf_glitch_filter.v'],
+    },
+    'CF_I2C_WB': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/../ip/CF_I2C/hdl/rtl/CF_I2C.v',
+                '$(USER_PROJECT_VERILOG)/../ip/CF_I2C/hdl/rtl/bus_wrappers/CF_I2C_WB.v'],
+        'deps': [f'{UTIL}/cf_fifo.v', f'{UTIL}/cf_glitch_filter.v'],
+    },
+    'CF_SRAM_1024x32_wb_wrapper': {
+        'rtl': ['$(USER_PROJECT_VERILOG)/../ip/CF_SRAM_1024x32/hdl/bus_wrapper/CF_SRAM_1024x32_wb_wrapper.v',
+                '$(USER_PROJECT_VERILOG)/../ip/CF_SRAM_1024x32/hdl/controllers/ram_wb_controller.v'],
+        'macros': ['$(USER_PROJECT_VERILOG)/../ip/CF_SRAM_1024x32/hdl/CF_SRAM_1024x32.v'],
+    },
+}
+
+RTL_INCLUDES = 'includes.rtl.caravel_user_project'
+MARKER = '# Gate-level blocks:'
+CELLS = ['$(PDK_ROOT)/$(PDK)/libs.ref/sky130_fd_sc_hd/verilog/primitives.v',
+         '$(PDK_ROOT)/$(PDK)/libs.ref/sky130_fd_sc_hd/verilog/sky130_fd_sc_hd.v']
+POWER = """`ifdef USE_POWER_PINS
+    .VGND(VGND),
+    .VNB(VGND),
+    .VPB(VPWR),
+    .VPWR(VPWR),
+`endif"""
+
+
+def load_design_info(user_project_root):
+    with open(f'{user_project_root}/verilog/dv/cocotb/design_info.yaml') as file:
+        return yaml.safe_load(file)
+
+
+def gl_blocks_for(design_info, test):
+    """Return the gate-level block set, letting a test entry override the default."""
+    blocks = design_info.get('gl_blocks') or []
+    for entry in design_info.get('tests') or []:
+        if entry.get('name') == test and 'gl_blocks' in entry:
+            blocks = entry['gl_blocks'] or []
+    return sorted(set(blocks))
+
+
+def check_blocks(blocks):
+    unknown = [block for block in blocks if block not in GL_BLOCKS]
+    if unknown:
+        raise click.BadParameter(
+            f"unknown block(s) {', '.join(unknown)}; choose from {', '.join(sorted(GL_BLOCKS))}")
+
+
+def resolve(path, user_project_root):
+    return path.replace('$(USER_PROJECT_VERILOG)', f'{user_project_root}/verilog')
+
+
+def gl_dir(user_project_root):
+    return f'{user_project_root}/verilog/gl_mixed'
+
+
+def instance_params(user_project_root, block):
+    """Read the parameter overrides of the block's instance in user_project.v."""
+    with open(f'{user_project_root}/verilog/rtl/user_project.v') as file:
+        source = re.sub(r'//.*', '', file.read())
+    match = re.search(rf'\b{block}\s*(?:`ifndef\s+\w+\s*)?#\s*\(', source)
+    if not match:
+        raise click.ClickException(f'no parameterized {block} instance in user_project.v')
+    depth, end = 1, match.end()
+    while depth:
+        depth += {'(': 1, ')': -1}.get(source[end], 0)
+        end += 1
+    localparams = dict(re.findall(r'localparam\s+(\w+)\s*=\s*(\d+)\s*;', source))
+
+    params = {}
+    for name, value in re.findall(r'\.(\w+)\s*\(\s*([^()]*?)\s*\)', source[match.end():end]):
+        value = localparams.get(value, value)
+        if not value.isdigit():
+            raise click.ClickException(
+                f'cannot resolve {block} parameter {name} = {value} in user_project.v')
+        params[name] = int(value)
+    return params
+
+
+def connect_power(netlist):
+    """Tie the cells' power pins, which yosys leaves unconnected."""
+    if not re.search(r'^\s*inout\s+VPWR\s*;', netlist, re.M):
+        header_end = re.search(r'^module\b.*?\);', netlist, re.M | re.S).end()
+        netlist = (netlist[:header_end]
+                   + '\n`ifdef USE_POWER_PINS\n  supply1 VPWR;\n  supply0 VGND;\n`endif'
+                   + netlist[header_end:])
+    return re.sub(r'^(\s*sky130_fd_sc_hd__\w+\s+.+\()$', rf'\1\n{POWER}', netlist, flags=re.M)
+
+
+def synth_sources(block, user_project_root):
+    config = GL_BLOCKS[block]
+    sources = [resolve(path, user_project_root)
+               for path in config.get('deps', []) + config['rtl']]
+    macros = [resolve(path, user_project_root) for path in config.get('macros', [])]
+    return sources, macros
+
+
+def synth_block(user_project_root, design_info, block):
+    sources, macros = synth_sources(block, user_project_root)
+    params = instance_params(user_project_root, block) if GL_BLOCKS[block].get('params') else {}
+    incdirs = ' '.join(sorted({f'-I{os.path.dirname(path)}' for path in sources}))
+    liberty = (f"{design_info['PDK_ROOT']}/{design_info['PDK']}/libs.ref/sky130_fd_sc_hd/lib/"
+               'sky130_fd_sc_hd__tt_025C_1v80.lib')
+    netlist = f'{gl_dir(user_project_root)}/{block}.v'
+
+    script = []
+    if macros:
+        script.append(f"read_verilog -lib {' '.join(macros)}")
+    script.append(f"read_verilog -sv -DUSE_POWER_PINS {incdirs} {' '.join(sources)}")
+    for name, value in params.items():
+        script.append(f'chparam -set {name} {value} {block}')
+    script += [
+        f'synth -flatten -top {block}',
+        f'dfflibmap -liberty {liberty}',
+        f'abc -liberty {liberty}',
+        'hilomap -hicell sky130_fd_sc_hd__conb_1 HI -locell sky130_fd_sc_hd__conb_1 LO',
+        'splitnets',
+        'opt_clean -purge',
+        f'write_verilog -noattr -noexpr -nohex -nodec {netlist}',
+    ]
+
+    os.makedirs(gl_dir(user_project_root), exist_ok=True)
+    os.makedirs(f'{user_project_root}/logs', exist_ok=True)
+    log = f'{user_project_root}/logs/synth_{block}.log'
+    if subprocess.run(['yosys', '-q', '-l', log, '-p', '; '.join(script)]).returncode:
+        raise click.ClickException(f'synthesis of {block} failed, see {log}')
+
+    with open(netlist) as file:
+        content = connect_power(file.read())
+    with open(netlist, 'w') as file:
+        file.write(content)
+    with open(f'{gl_dir(user_project_root)}/{block}.json', 'w') as file:
+        json.dump({'params': params}, file)
+    return netlist
+
+
+def is_stale(user_project_root, block):
+    netlist = f'{gl_dir(user_project_root)}/{block}.v'
+    stamp = f'{gl_dir(user_project_root)}/{block}.json'
+    if not os.path.isfile(netlist) or not os.path.isfile(stamp):
+        return True
+    sources, macros = synth_sources(block, user_project_root)
+    built = os.path.getmtime(netlist)
+    if any(os.path.getmtime(path) > built for path in sources + macros + [__file__]):
+        return True
+    params = instance_params(user_project_root, block) if GL_BLOCKS[block].get('params') else {}
+    with open(stamp) as file:
+        return json.load(file).get('params') != params
+
+
+def mcw_cells(design_info):
+    """Return the cell models the caravel RTL include list already loads."""
+    path = f"{design_info['MCW_ROOT']}/verilog/includes/includes.rtl.caravel"
+    if not os.path.isfile(path):
+        return set()
+    with open(path) as file:
+        listed = file.read()
+    return {cells for cells in CELLS if os.path.basename(cells) in listed}
+
+
+def build_includes(rtl_lines, blocks, cells):
+    replaced = {path: block for block in blocks for path in GL_BLOCKS[block]['rtl']}
+    macros = ' '.join(f'GL_{block.upper()}' for block in blocks)
+    lines = [f"{MARKER} {', '.join(blocks)}", f'# Needs -macros {macros}']
+    for line in rtl_lines:
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == '-v' and fields[1] in replaced:
+            block = replaced.pop(fields[1])
+            line = f'-v $(USER_PROJECT_VERILOG)/gl_mixed/{block}.v'
+            if line in lines:
+                continue
+        lines.append(line)
+
+    if replaced:
+        raise click.ClickException(
+            f"not found in {RTL_INCLUDES}: {', '.join(sorted(replaced))}")
+    if cells:
+        lines += ['', '# Cell models for the netlists'] + [f'-v {path}' for path in cells]
+    return '\n'.join(lines) + '\n'
+
+
+def write_includes(user_project_root, design_info, blocks):
+    includes_dir = f'{user_project_root}/verilog/includes'
+    if not blocks:
+        return f'{includes_dir}/{RTL_INCLUDES}'
+
+    os.makedirs(gl_dir(user_project_root), exist_ok=True)
+    for block in blocks:
+        if is_stale(user_project_root, block):
+            click.echo(f'synthesizing {block}')
+            synth_block(user_project_root, design_info, block)
+
+    with open(f'{includes_dir}/{RTL_INCLUDES}') as file:
+        rtl_lines = file.read().splitlines()
+    cells = [path for path in CELLS if path not in mcw_cells(design_info)]
+    content = build_includes(rtl_lines, blocks, cells)
+    path = f"{gl_dir(user_project_root)}/includes.mixed.{'+'.join(blocks)}.caravel_user_project"
+    with open(path, 'w') as file:
+        file.write(content)
+    return path
+
+
+def backup_path(user_project_root):
+    return f'{gl_dir(user_project_root)}/{RTL_INCLUDES}.bak'
+
+
+def restore_rtl_includes(user_project_root):
+    backup = backup_path(user_project_root)
+    if not os.path.isfile(backup):
+        return False
+    shutil.copyfile(backup, f'{user_project_root}/verilog/includes/{RTL_INCLUDES}')
+    os.remove(backup)
+    return True
+
+
+def check_rtl_includes(user_project_root):
+    """Refuse to swap the RTL list if an interrupted run or local edits left it modified."""
+    rtl_includes = f'{user_project_root}/verilog/includes/{RTL_INCLUDES}'
+    with open(rtl_includes) as file:
+        if MARKER in file.read():
+            raise click.ClickException(
+                f'{RTL_INCLUDES} holds a mixed list from an interrupted run; run make mixed-restore')
+    status = subprocess.run(['git', 'status', '--porcelain', '--', rtl_includes],
+                            cwd=user_project_root, capture_output=True, text=True)
+    if status.returncode == 0 and status.stdout.strip():
+        raise click.ClickException(f'{RTL_INCLUDES} has local changes; commit or stash them first')
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('user_project_root', type=click.Path(exists=True))
+@click.argument('blocks', nargs=-1, required=True)
+def synth(user_project_root, blocks):
+    """Synthesize BLOCKS into verilog/gl_mixed/<block>.v."""
+    check_blocks(blocks)
+    design_info = load_design_info(user_project_root)
+    for block in blocks:
+        click.echo(synth_block(user_project_root, design_info, block))
+
+
+@cli.command()
+@click.argument('user_project_root', type=click.Path(exists=True))
+@click.option('-t', '--test', help='Use the gl_blocks entry of this test from design_info.yaml.')
+@click.option('-g', '--gl', 'gl', multiple=True,
+              help='Block to simulate at gate level (overrides design_info.yaml, repeatable).')
+def includes(user_project_root, test, gl):
+    """Write the mixed include list and print its path."""
+    design_info = load_design_info(user_project_root)
+    blocks = sorted(set(gl)) if gl else gl_blocks_for(design_info, test)
+    check_blocks(blocks)
+    click.echo(write_includes(user_project_root, design_info, blocks))
+
+
+@cli.command()
+@click.argument('user_project_root', type=click.Path(exists=True))
+@click.option('-t', '--test', required=True, help='Test to run.')
+@click.option('-g', '--gl', 'gl', multiple=True,
+              help='Block to simulate at gate level (overrides design_info.yaml, repeatable).')
+def run(user_project_root, test, gl):
+    """Run TEST as an RTL simulation with the mixed include list.
+
+    caravel_cocotb always compiles includes.rtl.caravel_user_project, so the
+    mixed list is swapped in for the run (a backup is kept in
+    verilog/gl_mixed/) and the original restored afterwards. Each block
+    combination runs under its own tag, so caravel_cocotb only recompiles
+    when a netlist or source in the list changed.
+    """
+    design_info = load_design_info(user_project_root)
+    blocks = sorted(set(gl)) if gl else gl_blocks_for(design_info, test)
+    check_blocks(blocks)
+    check_rtl_includes(user_project_root)
+    mixed = write_includes(user_project_root, design_info, blocks)
+
+    command = ['caravel_cocotb', '-test', test, '-sim', 'RTL', '-design_info', 'design_info.yaml']
+    if blocks:
+        command += ['-tag', f"mixed_{'+'.join(blocks)}",
+                    '-macros'] + [f'GL_{block.upper()}' for block in blocks]
+
+    rtl_includes = f'{user_project_root}/verilog/includes/{RTL_INCLUDES}'
+    if mixed != rtl_includes:
+        shutil.copyfile(rtl_includes, backup_path(user_project_root))
+    try:
+        if mixed != rtl_includes:
+            shutil.copyfile(mixed, rtl_includes)
+        result = subprocess.run(command, cwd=f'{user_project_root}/verilog/dv/cocotb')
+    finally:
+        restore_rtl_includes(user_project_root)
+    raise SystemExit(result.returncode)
+
+
+@cli.command()
+@click.argument('user_project_root', type=click.Path(exists=True))
+def restore(user_project_root):
+    """Restore includes.rtl.caravel_user_project after an interrupted run."""
+    if restore_rtl_includes(user_project_root):
+        click.echo(f'restored {RTL_INCLUDES}')
+    else:
+        click.echo('nothing to restore')
+
+
+if __name__ == "__main__":
+    cli()
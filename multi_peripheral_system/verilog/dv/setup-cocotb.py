@@ -13,6 +13,8 @@
 # limitations under the License.
 
 # SPDX-License-Identifier: Apache-2.0
+import os
+
 import click
 import yaml
 
@@ -31,10 +33,17 @@ def update_design_info(user_project_root):
         'emailto': [None]
     }
 
-    with open(f'{user_project_root}/verilog/dv/cocotb/design_info.yaml', 'w') as file:
+    # Keep the keys that are not regenerated here (DESIGN_NAME, include_paths, tests, gl_blocks)
+    design_info = f'{user_project_root}/verilog/dv/cocotb/design_info.yaml'
+    if os.path.isfile(design_info):
+        with open(design_info) as file:
+            for key, value in (yaml.safe_load(file) or {}).items():
+                data.setdefault(key, value)
+
+    with open(design_info, 'w') as file:
         yaml.dump(data, file)
 
-    with open(f'{user_project_root}/verilog/dv/cocotb/design_info.yaml', 'w') as file:
+    with open(design_info, 'w') as file:
         yaml_str = yaml.dump(data)
         yaml_str = yaml_str.replace("clk_period_ns: 25",
                                     "clk_period_ns: 25   # Clock period in nanoseconds")
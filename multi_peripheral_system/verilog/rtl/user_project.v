@@ -50,13 +50,18 @@ module user_project (
     wire [NUM_PERIPHERALS-1:0] s_wb_ack;
     wire [NUM_PERIPHERALS-1:0] s_wb_err;
 
-    wishbone_bus_splitter #(
+    // The gate-level netlist is synthesized with these values and has no parameters
+    wishbone_bus_splitter
+`ifndef GL_WISHBONE_BUS_SPLITTER
+    #(
         .NUM_PERIPHERALS(NUM_PERIPHERALS),
         .ADDR_WIDTH(32),
         .DATA_WIDTH(32),
         .SEL_WIDTH(4),
         .ADDR_SEL_LOW_BIT(16)
-    ) bus_splitter (
+    )
+`endif
+    bus_splitter (
         .m_wb_adr_i(wbs_adr_i),
         .m_wb_dat_i(wbs_dat_i),
         .m_wb_dat_o(wbs_dat_o),